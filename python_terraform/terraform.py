@@ -1,17 +1,297 @@
+import base64
+import codecs
+import functools
+import hashlib
 import json
+import keyword
 import logging
 import os
+import select
+import selectors
+import shlex
+import shutil
+import signal
 import subprocess
 import sys
 import tempfile
-from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type, Union
+import threading
+import time
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from python_terraform.tfstate import Tfstate
 
+if TYPE_CHECKING:
+    # asyncio and concurrent.futures are slow to import and only needed by the
+    # async and background helpers, which import them on first use
+    import asyncio
+    import concurrent.futures
+
 logger = logging.getLogger(__name__)
 
 COMMAND_WITH_SUBCOMMANDS = {"workspace"}
 
+# sub-commands bound as real methods of Terraform, others go through __getattr__
+TERRAFORM_COMMANDS = (
+    "apply",
+    "console",
+    "destroy",
+    "fmt",
+    "get",
+    "graph",
+    "import",
+    "init",
+    "output",
+    "plan",
+    "providers",
+    "refresh",
+    "show",
+    "state",
+    "taint",
+    "untaint",
+    "validate",
+    "version",
+    "workspace",
+)
+
+# commands which may write the state file, the others never require a re-read
+STATE_MUTATING_COMMANDS = {
+    "apply",
+    "destroy",
+    "import",
+    "init",
+    "refresh",
+    "state",
+    "taint",
+    "untaint",
+}
+
+# variable values which can be passed as -var=key=value without a var file
+SCALAR_VAR_TYPES = (str, int, float, bool)
+
+# a command with a timeout leads its own session, so that the children of a
+# wrapper like tfenv are killed with it, only possible on POSIX
+_HAS_KILLPG = hasattr(os, "killpg")
+
+
+def _quote_cmd(cmds: Iterable[str]) -> str:
+    """Render an argv list as a shell-quoted string"""
+    return " ".join(shlex.quote(c) for c in cmds)
+
+
+# options whose values often hold passwords or tokens, masked in the logs
+SECRET_OPTIONS = ("var", "backend-config")
+_SECRET_PREFIXES = tuple(f"-{option}=" for option in SECRET_OPTIONS)
+
+
+def _redact_arg(arg: str) -> str:
+    if arg.startswith(_SECRET_PREFIXES):
+        option, _, assignment = arg.partition("=")
+        name, sep, _ = assignment.partition("=")
+        if sep:
+            return f"{option}={name}=***"
+    return arg
+
+
+def _redact_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Options of a command, with the values of SECRET_OPTIONS dicts masked"""
+    redacted = dict(kwargs)
+    for option, value in kwargs.items():
+        if option.replace("_", "-") in SECRET_OPTIONS and isinstance(value, dict):
+            redacted[option] = dict.fromkeys(value, "***")
+    return redacted
+
+
+def _format_cmd(cmds: Iterable[str]) -> str:
+    """_quote_cmd for logging and errors only, with SECRET_OPTIONS masked"""
+    return _quote_cmd(_redact_arg(c) for c in cmds)
+
+
+def _tee_writer(stream: IO[str]) -> Callable[[bytes], None]:
+    """Return a function copying raw terraform output to stream as it arrives"""
+    buffer = getattr(stream, "buffer", None)
+    if buffer is not None:
+
+        def write(data: bytes) -> None:
+            buffer.write(data)
+            buffer.flush()
+
+    else:
+        # eg. a StringIO, chunks may end in the middle of a character
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+        def write(data: bytes) -> None:
+            stream.write(decoder.decode(data))
+            stream.flush()
+
+    return write
+
+
+def _communicate_tee(
+    p: subprocess.Popen, input: Optional[bytes], timeout: Optional[float] = None
+) -> Tuple[bytes, bytes]:
+    """Popen.communicate, also copying stdout/stderr to ours while capturing"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    captured = {p.stdout: bytearray(), p.stderr: bytearray()}
+    writers = {p.stdout: _tee_writer(sys.stdout), p.stderr: _tee_writer(sys.stderr)}
+    offset = 0
+
+    with selectors.DefaultSelector() as selector:
+        if input:
+            selector.register(p.stdin, selectors.EVENT_WRITE)
+        elif p.stdin:
+            p.stdin.close()
+        selector.register(p.stdout, selectors.EVENT_READ)
+        selector.register(p.stderr, selectors.EVENT_READ)
+
+        while selector.get_map():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise subprocess.TimeoutExpired(p.args, timeout)
+            for key, _ in selector.select(remaining):
+                if key.fileobj is p.stdin:
+                    try:
+                        # up to PIPE_BUF bytes can be written without blocking
+                        offset += os.write(
+                            key.fd, input[offset : offset + select.PIPE_BUF]
+                        )
+                    except BrokenPipeError:
+                        offset = len(input)
+                    if offset >= len(input):
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                    continue
+
+                data = os.read(key.fd, 32768)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    continue
+                captured[key.fileobj] += data
+                writers[key.fileobj](data)
+
+    p.wait(None if deadline is None else max(deadline - time.monotonic(), 0))
+    return bytes(captured[p.stdout]), bytes(captured[p.stderr])
+
+
+def _kill(
+    p: Union[subprocess.Popen, "asyncio.subprocess.Process"],
+    kill_group: bool,
+    sig: Optional[int] = None,
+) -> None:
+    """Send sig to terraform, SIGKILL by default
+
+    With kill_group, p leads its own session and all of it gets the signal,
+    so that the children of a shell do not keep the pipes open.
+    """
+    if not kill_group:
+        if sig is None:
+            p.kill()
+        else:
+            p.send_signal(sig)
+        return
+    try:
+        os.killpg(p.pid, signal.SIGKILL if sig is None else sig)
+    except ProcessLookupError:
+        pass
+
+
+def _stop_interrupted(
+    p: Union[None, subprocess.Popen, "asyncio.subprocess.Process"],
+    kill_group: bool,
+    exc: BaseException,
+) -> None:
+    """Stop terraform when waiting for it was interrupted by exc
+
+    A child in its own session does not get the Ctrl-C of the terminal, it is
+    passed on so that terraform can still stop gracefully and release its
+    state lock, anything else kills it. Other children are left alone as
+    before.
+    """
+    if p is None or not kill_group or p.returncode is not None:
+        return
+    _kill(p, True, signal.SIGINT if isinstance(exc, KeyboardInterrupt) else None)
+
+
+def _communicate(
+    p: subprocess.Popen,
+    input: Optional[bytes],
+    timeout: Optional[float],
+    tee: bool,
+    kill_group: bool = False,
+) -> Tuple[bytes, bytes]:
+    """Popen.communicate, killing terraform if it is still running after timeout
+
+    With kill_group, its whole session is killed, see _kill.
+    """
+    try:
+        if tee:
+            return _communicate_tee(p, input, timeout)
+        return p.communicate(input, timeout)
+    except subprocess.TimeoutExpired:
+        # same as subprocess.run, do not leave terraform running behind us
+        _kill(p, kill_group)
+        if tee:
+            # _communicate_tee may have closed some pipes already, which
+            # communicate() does not expect, and nothing is left to capture
+            for pipe in (p.stdin, p.stdout, p.stderr):
+                if pipe and not pipe.closed:
+                    pipe.close()
+            p.wait()
+        else:
+            p.communicate()
+        raise
+
+
+async def _communicate_tee_async(
+    p: "asyncio.subprocess.Process", input: Optional[bytes]
+) -> Tuple[bytes, bytes]:
+    """Coroutine version of _communicate_tee"""
+    import asyncio
+
+    async def feed() -> None:
+        if input:
+            p.stdin.write(input)
+            try:
+                await p.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        p.stdin.close()
+
+    async def drain(stream: "asyncio.StreamReader", stdio: IO[str]) -> bytes:
+        captured = bytearray()
+        write = _tee_writer(stdio)
+        while True:
+            data = await stream.read(32768)
+            if not data:
+                return bytes(captured)
+            captured += data
+            write(data)
+
+    aws = [drain(p.stdout, sys.stdout), drain(p.stderr, sys.stderr)]
+    if p.stdin:
+        aws.append(feed())
+    out, err, *_ = await asyncio.gather(*aws)
+    await p.wait()
+    return out, err
+
 
 class TerraformFlag:
     pass
@@ -36,12 +316,156 @@ class TerraformCommandError(subprocess.CalledProcessError):
         logger.error("Error with command %s. Reason: %s", self.cmd, self.err)
 
 
+_UNDERSCORE_TO_DASH = str.maketrans("_", "-")
+
+# shared by Terraform.submit, created on first use
+_executor: Optional["concurrent.futures.ThreadPoolExecutor"] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> "concurrent.futures.ThreadPoolExecutor":
+    import concurrent.futures
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # terraform runs are mostly waiting on the child process and the
+            # network, so the pool is larger than the number of cores
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=(os.cpu_count() or 1) * 3,
+                thread_name_prefix="python-terraform",
+            )
+    return _executor
+
+
+@functools.lru_cache(maxsize=32)
+def _which(bin_path: str, cwd: str, path: str) -> Optional[str]:
+    """Absolute path of the binary which Popen would run, memoized across calls
+
+    This lets the child execve() the binary directly instead of searching
+    every PATH entry on each call. As with Popen, a relative path with a
+    folder in it is taken relative to cwd, the working folder of the child.
+    """
+    if os.path.dirname(bin_path):
+        bin_path = os.path.join(cwd, bin_path)
+    which = shutil.which(bin_path, path=path)
+    # relative PATH entries are searched from cwd too, left to Popen
+    return which if which and os.path.isabs(which) else None
+
+
+@functools.lru_cache(maxsize=128)
+def _split_cmd(cmd: str) -> Tuple[str, ...]:
+    """Tokenize a command like 'workspace show', memoized across calls"""
+    return tuple(cmd.split())
+
+
+def _emit_scalar(cmds: List[str], option: str, value: Any, tf: "Terraform") -> None:
+    cmds.append(f"-{option}={value}")
+
+
+def _emit_bool(cmds: List[str], option: str, value: bool, tf: "Terraform") -> None:
+    cmds.append(f"-{option}=true" if value else f"-{option}=false")
+
+
+def _emit_list(cmds: List[str], option: str, value: List[Any], tf: "Terraform") -> None:
+    cmds.extend(f"-{option}={sub_v}" for sub_v in value)
+
+
+def _emit_dict(
+    cmds: List[str], option: str, value: Dict[str, Any], tf: "Terraform"
+) -> None:
+    if "backend-config" in option:
+        cmds.extend(f"-backend-config={bk}={bv}" for bk, bv in value.items())
+
+    elif option == "var":
+        # with inline_vars, scalar variables skip writing, and later unlinking,
+        # a temp file, but their values become visible to `ps` and the like
+        if tf.inline_vars and all(
+            isinstance(v, SCALAR_VAR_TYPES) for v in value.values()
+        ):
+            for vk, vv in value.items():
+                if isinstance(vv, bool):
+                    vv = "true" if vv else "false"
+                cmds.append(f"-var={vk}={vv}")
+            return
+
+        # since map type sent in string won't work, create temp var file for
+        # variables, and clean it up later, this also keeps the values off the
+        # command line
+        filename = tf.temp_var_files.create(value)
+        cmds.append(f"-var-file={filename}")
+
+    else:
+        _emit_scalar(cmds, option, value, tf)
+
+
+def _emit_flag(cmds: List[str], option: str, value: type, tf: "Terraform") -> None:
+    # simple flag, IsFlagged and IsNotFlagged are passed as classes
+    if value is IsFlagged:
+        cmds.append(f"-{option}")
+    elif value is not IsNotFlagged:
+        _emit_scalar(cmds, option, value, tf)
+
+
+def _skip_option(cmds: List[str], option: str, value: None, tf: "Terraform") -> None:
+    pass
+
+
+# values which never emit anything, see generate_cmd_string
+_EMPTY_OPTIONS = ([], {})
+
+OptionEmitter = Callable[[List[str], str, Any, "Terraform"], None]
+
+# one dict lookup on the exact type instead of a chain of isinstance checks
+_OPTION_EMITTERS: Dict[type, OptionEmitter] = {
+    list: _emit_list,
+    dict: _emit_dict,
+    bool: _emit_bool,
+    type: _emit_flag,
+    type(None): _skip_option,
+}
+
+
+def _get_option_emitter(value: Any) -> OptionEmitter:
+    emitter = _OPTION_EMITTERS.get(type(value))
+    if emitter is not None:
+        return emitter
+
+    # subclasses, eg. OrderedDict, are still handled like their base type
+    for base in (list, dict):
+        if isinstance(value, base):
+            return _OPTION_EMITTERS[base]
+    return _emit_scalar
+
+
 class Terraform:
     """Wrapper of terraform command line tool.
 
     https://www.terraform.io/
+
+    Instances have no __dict__, a subclass that does not define __slots__
+    gets one back if extra attributes are needed.
     """
 
+    __slots__ = (
+        "is_env_vars_included",
+        "working_dir",
+        "state",
+        "targets",
+        "variables",
+        "parallelism",
+        "terraform_bin_path",
+        "plugin_cache_dir",
+        "timeout",
+        "inline_vars",
+        "var_file",
+        "temp_var_files",
+        "_tfstate",
+        "_tfstate_pending",
+        "_tfstate_digest",
+        "_state_stat",
+    )
+
     def __init__(
         self,
         working_dir: Optional[str] = None,
@@ -52,6 +476,9 @@ class Terraform:
         var_file: Optional[str] = None,
         terraform_bin_path: Optional[str] = None,
         is_env_vars_included: bool = True,
+        plugin_cache_dir: Optional[str] = None,
+        timeout: Optional[float] = None,
+        inline_vars: bool = False,
     ):
         """
         :param working_dir: the folder of the working folder, if not given,
@@ -65,9 +492,18 @@ class Terraform:
         :param parallelism: default parallelism value for apply/destroy command
         :param var_file: passed as value of -var-file option,
                 could be string or list, list stands for multiple -var-file option
-        :param terraform_bin_path: binary path of terraform
+        :param terraform_bin_path: binary path of terraform, a relative path is
+                taken relative to working_dir
         :type is_env_vars_included: bool
         :param is_env_vars_included: included env variables when calling terraform cmd
+        :param plugin_cache_dir: passed as TF_PLUGIN_CACHE_DIR, so providers are
+                downloaded once and shared by every init, created if missing,
+                a relative path is taken relative to the current folder
+        :param timeout: default number of seconds a command may run, terraform is
+                killed and subprocess.TimeoutExpired raised past it
+        :param inline_vars: pass "var" dicts of scalar values as -var options
+                instead of a temp var file, this saves writing the file but makes
+                the values visible in the process list of the machine
         """
         self.is_env_vars_included = is_env_vars_included
         self.working_dir = working_dir
@@ -80,9 +516,22 @@ class Terraform:
         )
         self.var_file = var_file
         self.temp_var_files = VariableFiles()
-
-        # store the tfstate data
-        self.tfstate = None
+        # terraform ignores the cache dir when it does not exist, it runs in
+        # working_dir so a relative one is fixed from our cwd
+        if plugin_cache_dir:
+            plugin_cache_dir = os.path.abspath(plugin_cache_dir)
+            os.makedirs(plugin_cache_dir, exist_ok=True)
+        self.plugin_cache_dir = plugin_cache_dir
+        self.timeout = timeout
+        self.inline_vars = inline_vars
+
+        # store the tfstate data, parsed on first access of self.tfstate
+        self._tfstate: Optional[Tfstate] = None
+        self._tfstate_pending: Optional[str] = None
+        # digest of the contents self.tfstate was parsed from
+        self._tfstate_digest: Optional[bytes] = None
+        # (path, inode, mtime, size) of the state file self.tfstate was read from
+        self._state_stat: Optional[Tuple[str, int, int, int]] = None
         self.read_state_file(self.state)
 
     def __getattr__(self, item: str) -> Callable:
@@ -90,7 +539,8 @@ class Terraform:
             cmd_name = str(item)
             if cmd_name.endswith("_cmd"):
                 cmd_name = cmd_name[:-4]
-            logger.debug("called with %r and %r", args, kwargs)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("called with %r and %r", args, _redact_kwargs(kwargs))
             return self.cmd(cmd_name, *args, **kwargs)
 
         return wrapper
@@ -115,13 +565,37 @@ class Terraform:
         """
         if not skip_plan:
             return self.plan(dir_or_plan=dir_or_plan, **kwargs)
+        args, options = self._apply_cmd_args(dir_or_plan, input, no_color, kwargs)
+        return self.cmd("apply", *args, **options)
+
+    async def apply_async(
+        self,
+        dir_or_plan: Optional[str] = None,
+        input: bool = False,
+        skip_plan: bool = True,
+        no_color: Type[TerraformFlag] = IsFlagged,
+        **kwargs,
+    ) -> CommandOutput:
+        """Coroutine version of 'apply', see 'cmd_async'"""
+        if not skip_plan:
+            return await self.plan_async(dir_or_plan=dir_or_plan, **kwargs)
+        args, options = self._apply_cmd_args(dir_or_plan, input, no_color, kwargs)
+        return await self.cmd_async("apply", *args, **options)
+
+    def _apply_cmd_args(
+        self,
+        dir_or_plan: Optional[str],
+        input: bool,
+        no_color: Type[TerraformFlag],
+        kwargs: Dict[str, Any],
+    ) -> Tuple[Sequence[str], Dict[str, Any]]:
         default = kwargs.copy()
         default["input"] = input
         default["no_color"] = no_color
         default["auto-approve"] = True  # a False value will require an input
         option_dict = self._generate_default_options(default)
         args = self._generate_default_args(dir_or_plan)
-        return self.cmd("apply", *args, **option_dict)
+        return args, option_dict
 
     def _generate_default_args(self, dir_or_plan: Optional[str]) -> Sequence[str]:
         return [dir_or_plan] if dir_or_plan else []
@@ -170,11 +644,30 @@ class Terraform:
         :param kwargs: options
         :return: ret_code, stdout, stderr
         """
+        args, options = self._plan_cmd_args(dir_or_plan, detailed_exitcode, kwargs)
+        return self.cmd("plan", *args, **options)
+
+    async def plan_async(
+        self,
+        dir_or_plan: Optional[str] = None,
+        detailed_exitcode: Type[TerraformFlag] = IsFlagged,
+        **kwargs,
+    ) -> CommandOutput:
+        """Coroutine version of 'plan', see 'cmd_async'"""
+        args, options = self._plan_cmd_args(dir_or_plan, detailed_exitcode, kwargs)
+        return await self.cmd_async("plan", *args, **options)
+
+    def _plan_cmd_args(
+        self,
+        dir_or_plan: Optional[str],
+        detailed_exitcode: Type[TerraformFlag],
+        kwargs: Dict[str, Any],
+    ) -> Tuple[Sequence[str], Dict[str, Any]]:
         options = kwargs.copy()
         options["detailed_exitcode"] = detailed_exitcode
         options = self._generate_default_options(options)
         args = self._generate_default_args(dir_or_plan)
-        return self.cmd("plan", *args, **options)
+        return args, options
 
     def init(
         self,
@@ -234,53 +727,20 @@ class Terraform:
         :param kwargs: same as kwags in method 'cmd'
         :return: string of valid terraform command
         """
-        cmds = cmd.split()
-        cmds = [self.terraform_bin_path] + cmds
+        cmds = [self.terraform_bin_path, *_split_cmd(cmd)]
         if cmd in COMMAND_WITH_SUBCOMMANDS:
             args = list(args)
             subcommand = args.pop(0)
             cmds.append(subcommand)
 
         for option, value in kwargs.items():
-            if "_" in option:
-                option = option.replace("_", "-")
-
-            if isinstance(value, list):
-                for sub_v in value:
-                    cmds += [f"-{option}={sub_v}"]
+            # most default options are unset, leave them before any dispatch
+            if value is None or value is IsNotFlagged or value in _EMPTY_OPTIONS:
                 continue
+            option = option.translate(_UNDERSCORE_TO_DASH)
+            _get_option_emitter(value)(cmds, option, value, self)
 
-            if isinstance(value, dict):
-                if "backend-config" in option:
-                    for bk, bv in value.items():
-                        cmds += [f"-backend-config={bk}={bv}"]
-                    continue
-
-                # since map type sent in string won't work, create temp var file for
-                # variables, and clean it up later
-                elif option == "var":
-                    # We do not create empty var-files if there is no var passed.
-                    # An empty var-file would result in an error: An argument or block definition is required here
-                    if value:
-                        filename = self.temp_var_files.create(value)
-                        cmds += [f"-var-file={filename}"]
-
-                    continue
-
-            # simple flag,
-            if value is IsFlagged:
-                cmds += [f"-{option}"]
-                continue
-
-            if value is None or value is IsNotFlagged:
-                continue
-
-            if isinstance(value, bool):
-                value = "true" if value else "false"
-
-            cmds += [f"-{option}={value}"]
-
-        cmds += args
+        cmds.extend(args)
         return cmds
 
     def cmd(
@@ -290,6 +750,10 @@ class Terraform:
         capture_output: Union[bool, str] = True,
         raise_on_error: bool = True,
         synchronous: bool = True,
+        stdin: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        tee: bool = False,
+        timeout: Optional[float] = None,
         **kwargs,
     ) -> CommandOutput:
         """Run a terraform command, if success, will try to read state file
@@ -309,6 +773,7 @@ class Terraform:
                 if the option 'capture_output' is passed (with any value other than
                     True), terraform output will be printed to stdout/stderr and
                     "None" will be returned as out and err.
+                    Pass "discard" to send the output to os.devnull instead.
                 if the option 'raise_on_error' is passed (with any value that evaluates to True),
                     and the terraform command returns a nonzerop return code, then
                     a TerraformCommandError exception will be raised. The exception object will
@@ -316,44 +781,184 @@ class Terraform:
                       returncode: The command's return code
                       out: The captured stdout, or None if not captured
                       err: The captured stderr, or None if not captured
+                if the option 'stdin' is passed, the string is written to the
+                    standard input of terraform, which is then closed
+                if the option 'env' is passed, those variables are added to the
+                    environment of terraform
+                if the option 'tee' is True and output is captured, terraform
+                    output is also streamed to stdout/stderr as it arrives
+                    (not supported on Windows)
+                if the option 'timeout' is passed, it overrides the timeout of
+                    the instance for this command
         :return: ret_code, out, err
         """
+        if timeout is None:
+            timeout = self.timeout
+        # cmds is handed to Popen as an argv list, no intermediate shell is spawned
+        cmds = self.generate_cmd_string(cmd, *args, **kwargs)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Command: %s", _format_cmd(cmds))
+
+        popen_kwargs = self._popen_kwargs(capture_output, stdin, env, timeout)
+        kill_group = popen_kwargs["start_new_session"]
+        p = None
+        try:
+            p = subprocess.Popen(cmds, **popen_kwargs)
+
+            if not synchronous:
+                return None, None, None
+
+            input = None if stdin is None else stdin.encode()
+            tee = tee and capture_output is True
+            out, err = _communicate(p, input, timeout, tee, kill_group)
+        except BaseException as e:
+            _stop_interrupted(p, kill_group, e)
+            # eg. terraform binary not found, do not leak the temp var files
+            self.temp_var_files.clean_up()
+            raise
+
+        return self._handle_result(
+            cmds,
+            p.returncode,
+            out,
+            err,
+            capture_output,
+            raise_on_error,
+            read_state=_split_cmd(cmd)[0] in STATE_MUTATING_COMMANDS,
+        )
+
+    async def cmd_async(
+        self,
+        cmd: str,
+        *args,
+        capture_output: Union[bool, str] = True,
+        raise_on_error: bool = True,
+        stdin: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        tee: bool = False,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> CommandOutput:
+        """Coroutine version of 'cmd', built on asyncio subprocesses
+
+        A single event loop can drive many terraform processes at once, eg.
+        with asyncio.gather. Concurrent commands must use distinct Terraform
+        instances, as temp var files and the state are tracked per instance.
+
+        :param cmd: command and sub-command of terraform, seperated with space
+        :param args: arguments of a command
+        :param kwargs: same as kwags in method 'cmd'
+        :return: ret_code, out, err
+        """
+        import asyncio
+
+        if timeout is None:
+            timeout = self.timeout
+        cmds = self.generate_cmd_string(cmd, *args, **kwargs)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Command: %s", _format_cmd(cmds))
+
+        popen_kwargs = self._popen_kwargs(capture_output, stdin, env, timeout)
+        kill_group = popen_kwargs["start_new_session"]
+        p = None
+        try:
+            p = await asyncio.create_subprocess_exec(*cmds, **popen_kwargs)
+            input = None if stdin is None else stdin.encode()
+            if tee and capture_output is True:
+                communicate = _communicate_tee_async(p, input)
+            else:
+                communicate = p.communicate(input)
+            try:
+                out, err = await asyncio.wait_for(communicate, timeout)
+            except asyncio.TimeoutError:
+                _kill(p, kill_group)
+                await p.wait()
+                raise subprocess.TimeoutExpired(cmds, timeout) from None
+        except BaseException as e:
+            # including the cancellation of this coroutine
+            _stop_interrupted(p, kill_group, e)
+            self.temp_var_files.clean_up()
+            raise
+
+        return self._handle_result(
+            cmds,
+            p.returncode,
+            out,
+            err,
+            capture_output,
+            raise_on_error,
+            read_state=_split_cmd(cmd)[0] in STATE_MUTATING_COMMANDS,
+        )
+
+    def _popen_kwargs(
+        self,
+        capture_output: Union[bool, str],
+        stdin: Optional[str],
+        env: Optional[Dict[str, str]],
+        timeout: Optional[float],
+    ) -> Dict[str, Any]:
         if capture_output is True:
             stderr = subprocess.PIPE
             stdout = subprocess.PIPE
         elif capture_output == "framework":
             stderr = None
             stdout = None
+        elif capture_output == "discard":
+            stderr = subprocess.DEVNULL
+            stdout = subprocess.DEVNULL
         else:
             stderr = sys.stderr
             stdout = sys.stdout
 
-        cmds = self.generate_cmd_string(cmd, *args, **kwargs)
-        logger.info("Command: %s", " ".join(cmds))
-
         working_folder = self.working_dir if self.working_dir else None
 
-        environ_vars = {}
+        if self.plugin_cache_dir:
+            env = {"TF_PLUGIN_CACHE_DIR": self.plugin_cache_dir, **(env or {})}
+
+        # env=None lets the child inherit our environment without copying it
         if self.is_env_vars_included:
-            environ_vars = os.environ.copy()
+            environ_vars = {**os.environ, **env} if env else None
+        else:
+            environ_vars = dict(env) if env else {}
 
-        p = subprocess.Popen(
-            cmds, stdout=stdout, stderr=stderr, cwd=working_folder, env=environ_vars
+        environ = os.environ if environ_vars is None else environ_vars
+        executable = _which(
+            self.terraform_bin_path,
+            os.path.abspath(working_folder or os.curdir),
+            environ.get("PATH", os.defpath),
         )
 
-        if not synchronous:
-            return None, None, None
+        return {
+            "executable": executable,
+            "stdin": None if stdin is None else subprocess.PIPE,
+            "stdout": stdout,
+            "stderr": stderr,
+            "cwd": working_folder,
+            "env": environ_vars,
+            # only detached when it may have to be killed, as a whole
+            "start_new_session": timeout is not None and _HAS_KILLPG,
+        }
 
-        out, err = p.communicate()
-        ret_code = p.returncode
+    def _handle_result(
+        self,
+        cmds: List[str],
+        ret_code: int,
+        out: Optional[bytes],
+        err: Optional[bytes],
+        capture_output: Union[bool, str],
+        raise_on_error: bool,
+        read_state: bool,
+    ) -> CommandOutput:
+        # terraform exited, its temp var files are not needed anymore
+        self.temp_var_files.clean_up()
         logger.info("output: %s", out)
 
         if ret_code == 0:
-            self.read_state_file()
+            if read_state:
+                self._read_state_file(None, reuse=True)
         else:
             logger.warning("error: %s", err)
 
-        self.temp_var_files.clean_up()
         if capture_output is True:
             out = out.decode()
             err = err.decode()
@@ -362,10 +967,151 @@ class Terraform:
             err = None
 
         if ret_code and raise_on_error:
-            raise TerraformCommandError(ret_code, " ".join(cmds), out=out, err=err)
+            raise TerraformCommandError(ret_code, _format_cmd(cmds), out=out, err=err)
 
         return ret_code, out, err
 
+    def batch(
+        self,
+        steps: Sequence[Tuple[str, Sequence[str], Dict[str, Any]]],
+        capture_output: Union[bool, str] = True,
+        raise_on_error: bool = True,
+        env: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> CommandOutput:
+        """Run several terraform commands in a row, as a single process tree
+
+        The commands are chained with && in one `/bin/sh -c` call, so a failing
+        step stops the batch. The state file is read once at the end, even
+        after a failure if a step before could have changed it. This is
+        the only method which goes through a shell, it is not available on
+        Windows.
+
+        :param steps: (cmd, args, kwargs) of each command, same as in 'cmd'
+        :param capture_output: same as in 'cmd'
+        :param raise_on_error: same as in 'cmd'
+        :param env: same as in 'cmd'
+        :param timeout: same as in 'cmd', for the whole batch
+        :return: ret_code, out, err of the whole batch
+        :example:
+            >>> tf = Terraform(working_dir='/home/test')
+            >>> tf.batch([
+            ...     ('init', [], {}),
+            ...     ('apply', [], {'auto_approve': IsFlagged}),
+            ... ])
+        """
+        if timeout is None:
+            timeout = self.timeout
+        popen_kwargs = self._popen_kwargs(capture_output, None, env, timeout)
+        # the shell runs the binary the other methods would run
+        bin_path = popen_kwargs["executable"] or self.terraform_bin_path
+        popen_kwargs["executable"] = None
+        kill_group = popen_kwargs["start_new_session"]
+
+        script, display = [], []
+        read_state = False
+        for cmd, args, options in steps:
+            cmds = self.generate_cmd_string(cmd, *args, **options)
+            cmds[0] = bin_path
+            script.append(_quote_cmd(cmds))
+            display.append(_format_cmd(cmds))
+            read_state |= _split_cmd(cmd)[0] in STATE_MUTATING_COMMANDS
+
+        cmds = ["/bin/sh", "-c", " && ".join(script)]
+        # what is logged and put in errors, with SECRET_OPTIONS masked
+        display_cmds = ["/bin/sh", "-c", " && ".join(display)]
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Command: %s", _format_cmd(display_cmds))
+
+        p = None
+        try:
+            p = subprocess.Popen(cmds, **popen_kwargs)
+            out, err = _communicate(p, None, timeout, False, kill_group)
+        except BaseException as e:
+            _stop_interrupted(p, kill_group, e)
+            self.temp_var_files.clean_up()
+            raise
+
+        # an earlier step may have changed the state before a later one failed
+        if read_state and p.returncode:
+            self._read_state_file(None, reuse=True)
+
+        return self._handle_result(
+            display_cmds,
+            p.returncode,
+            out,
+            err,
+            capture_output,
+            raise_on_error,
+            read_state=read_state,
+        )
+
+    def submit(self, cmd: str, *args, **kwargs) -> "concurrent.futures.Future":
+        """Run 'cmd' in a background thread and return a Future of its result
+
+        Unlike synchronous=False, the output, state refresh and temp file
+        clean up are all handled. Commands submitted at the same time must
+        use distinct Terraform instances.
+
+        :param cmd: command and sub-command of terraform, same as in 'cmd'
+        :param args: arguments of the command
+        :param kwargs: same as kwags in method 'cmd'
+        :return: Future resolving to (ret_code, out, err), or raising
+                 TerraformCommandError
+        :example:
+            >>> roots = [Terraform(working_dir=d) for d in ('/a', '/b')]
+            >>> futures = [tf.submit('plan') for tf in roots]
+            >>> concurrent.futures.wait(futures)
+        """
+        return _get_executor().submit(self.cmd, cmd, *args, **kwargs)
+
+    @classmethod
+    def parallel_cmd(
+        cls,
+        instances: Sequence["Terraform"],
+        cmd: str,
+        *args,
+        max_workers: int = 8,
+        **kwargs,
+    ) -> Dict["Terraform", CommandOutput]:
+        """Run the same command on several Terraform instances concurrently
+
+        Each terraform process has its own working folder and state, so
+        independent roots can be planned/applied/destroyed side by side.
+        Two instances sharing a working folder would race on the same state
+        file, this is refused.
+
+        :param instances: Terraform instances, one per working folder
+        :param cmd: command and sub-command of terraform, same as in 'cmd'
+        :param args: arguments of the command
+        :param max_workers: maximum number of terraform processes at a time
+        :param kwargs: same as kwags in method 'cmd'
+        :return: dict of instance -> (ret_code, out, err), if raise_on_error
+                 is set, the first TerraformCommandError is raised once all
+                 the commands finished
+        :example:
+            >>> roots = [Terraform(working_dir=d) for d in ('/a', '/b')]
+            >>> Terraform.parallel_cmd(roots, 'plan', no_color=IsFlagged)
+        """
+        import concurrent.futures
+
+        working_dirs = set()
+        for instance in instances:
+            working_dir = os.path.abspath(instance.working_dir or os.curdir)
+            if working_dir in working_dirs:
+                raise ValueError(
+                    f"{working_dir} is used by more than one Terraform instance"
+                )
+            working_dirs.add(working_dir)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                instance: pool.submit(instance.cmd, cmd, *args, **kwargs)
+                for instance in instances
+            }
+
+        return {instance: future.result() for instance, future in futures.items()}
+
     def output(
         self, *args, capture_output: bool = True, **kwargs
     ) -> Union[None, str, Dict[str, str], Dict[str, Dict[str, str]]]:
@@ -402,13 +1148,59 @@ class Terraform:
 
         return json.loads(out.lstrip())
 
+    def evaluate(
+        self, *expressions: str, capture_output: bool = True, **kwargs
+    ) -> Optional[List[Any]]:
+        """Evaluate expressions with a single `terraform console` run
+
+        Starting terraform dominates the cost of small read-only queries, so
+        all expressions are sent in one batch rather than one process each.
+        Root module outputs are not addressable from the console, use
+        `output` for those.
+
+        :param expressions: terraform expressions, eg. 'var.foo' or
+                            'aws_instance.bar.id'
+        :param kwargs: options passed to the console command, eg. var
+        :return: None, if an error occured
+                 list of the evaluated values, in the order of expressions
+        :example:
+            >>> tf = Terraform(working_dir='/home/test')
+            >>> tf.evaluate('var.a', 'length(var.b)')
+            ['a', 2]
+        """
+        if capture_output is False:
+            raise ValueError("capture_output is required for this method")
+
+        if not expressions:
+            return []
+
+        # the piped console only prints the value of the last line it reads,
+        # so the expressions are folded into a single json encoded tuple, then
+        # base64 encoded, which no version of terraform escapes when quoting it
+        batch = f"base64encode(jsonencode([{', '.join(expressions)}]))\n"
+        ret, out, _ = self.cmd("console", stdin=batch, **kwargs)
+
+        if ret:
+            return None
+
+        # terraform >= 0.15 prints string values quoted
+        return json.loads(base64.b64decode(out.strip().strip('"')))
+
     def read_state_file(self, file_path=None) -> None:
         """Read .tfstate file
 
+        The file is parsed again on the next access of tfstate, edits made to
+        the current tfstate are lost. The read done after a command only does
+        so when the file changed, and keeps the current tfstate otherwise.
+
         :param file_path: relative path to working dir
         :return: states file in dict type
         """
+        self._read_state_file(file_path, reuse=False)
 
+    def _read_state_file(self, file_path: Optional[str], reuse: bool) -> None:
+        """read_state_file, with reuse the current tfstate is kept while the
+        file has the same stat, or else the same contents"""
         working_dir = self.working_dir or ""
 
         file_path = file_path or self.state or ""
@@ -423,7 +1215,38 @@ class Terraform:
 
         file_path = os.path.join(working_dir, file_path)
 
-        self.tfstate = Tfstate.load_file(file_path)
+        try:
+            st = os.stat(file_path)
+            state_stat = (file_path, st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            state_stat = None
+
+        if not reuse:
+            self._tfstate_digest = None
+        # the file did not change since it was last read
+        elif state_stat is not None and state_stat == self._state_stat:
+            return
+
+        self._state_stat = state_stat
+        self._tfstate_pending = file_path
+
+    @property
+    def tfstate(self) -> Optional[Tfstate]:
+        """State from the last read_state_file, the file is parsed on first access"""
+        if self._tfstate_pending is not None:
+            file_path, self._tfstate_pending = self._tfstate_pending, None
+            self._tfstate, self._tfstate_digest = Tfstate._load_file(
+                file_path, self._tfstate, self._tfstate_digest
+            )
+        return self._tfstate
+
+    @tfstate.setter
+    def tfstate(self, tfstate: Optional[Tfstate]) -> None:
+        self._tfstate = tfstate
+        self._tfstate_pending = None
+        self._tfstate_digest = None
+        # no longer what the file holds, parsed again even after a command
+        self._state_stat = None
 
     def set_workspace(self, workspace, *args, **kwargs) -> CommandOutput:
         """Set workspace
@@ -479,24 +1302,72 @@ class Terraform:
         self.temp_var_files.clean_up()
 
 
+def _make_cmd_method(name: str) -> Callable[..., CommandOutput]:
+    def method(self: Terraform, *args, **kwargs) -> CommandOutput:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("called with %r and %r", args, _redact_kwargs(kwargs))
+        return self.cmd(name, *args, **kwargs)
+
+    method.__name__ = method.__qualname__ = name
+    method.__doc__ = f"Refer to https://www.terraform.io/docs/commands/{name}.html"
+    return method
+
+
+for _name in TERRAFORM_COMMANDS:
+    # 'import' can only be reached as import_cmd, methods defined above win
+    if not keyword.iskeyword(_name) and not hasattr(Terraform, _name):
+        setattr(Terraform, _name, _make_cmd_method(_name))
+    setattr(Terraform, f"{_name}_cmd", _make_cmd_method(_name))
+del _name
+
+
+def _dump_variables(variables: Dict[str, Any]) -> bytes:
+    if orjson is None:
+        # same compact utf-8 output as orjson
+        return json.dumps(variables, separators=(",", ":"), ensure_ascii=False).encode()
+    # json.dumps turns non string keys into strings as well
+    return orjson.dumps(variables, option=orjson.OPT_NON_STR_KEYS)
+
+
 class VariableFiles:
+    """Temp var files of a Terraform instance, all kept in a single temp dir
+
+    The dir is created on first use and removed as a whole by clean_up.
+    Identical variables are only written once until then.
+    """
+
+    __slots__ = ("dir", "files", "_files_by_digest")
+
     def __init__(self):
-        self.files = []
+        self.dir: Optional[str] = None
+        self.files: List[str] = []
+        self._files_by_digest: Dict[bytes, str] = {}
 
     def create(self, variables: Dict[str, str]) -> str:
-        with tempfile.NamedTemporaryFile(
-            "w+t", suffix=".tfvars.json", delete=False
-        ) as temp:
-            logger.debug("%s is created", temp.name)
-            self.files.append(temp)
-            logger.debug("variables wrote to tempfile: %s", variables)
-            temp.write(json.dumps(variables))
-            file_name = temp.name
+        payload = _dump_variables(variables)
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        if digest in self._files_by_digest:
+            return self._files_by_digest[digest]
+
+        if self.dir is None:
+            self.dir = tempfile.mkdtemp(prefix="python-terraform-")
+
+        file_name = os.path.join(self.dir, f"{len(self.files)}.tfvars.json")
+        with open(file_name, "xb") as f:
+            f.write(payload)
+        logger.debug("%s is created", file_name)
+        # names only, the values are often passwords or tokens
+        logger.debug("variables wrote to tempfile: %s", ", ".join(map(str, variables)))
+        self.files.append(file_name)
+        self._files_by_digest[digest] = file_name
 
         return file_name
 
     def clean_up(self):
-        for f in self.files:
-            os.unlink(f.name)
+        if self.dir is None:
+            return
 
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.dir = None
         self.files = []
+        self._files_by_digest = {}
@@ -1,10 +1,47 @@
+import contextlib
+import hashlib
 import json
 import logging
+import mmap
 import os
-from typing import Dict, Optional
+from collections import OrderedDict
+from typing import IO, Any, Dict, Iterator, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# with orjson, state files from this size on are mapped instead of read
+MMAP_THRESHOLD = 1024 * 1024
+
+# parsed state files shared by all Terraform instances of the process, keyed
+# by (path, inode, mtime, size), set PYTHON_TERRAFORM_STATE_CACHE=1 to enable it
+STATE_CACHE_ENV_VAR = "PYTHON_TERRAFORM_STATE_CACHE"
+STATE_CACHE_SIZE = 32
+_StateCacheKey = Tuple[str, int, int, int]
+_STATE_CACHE: "OrderedDict[_StateCacheKey, Tuple[Tfstate, bytes]]" = OrderedDict()
+
+
+@contextlib.contextmanager
+def _file_contents(f: IO[bytes]) -> Iterator[Union[bytes, memoryview]]:
+    if orjson is None or os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+        yield f.read()
+        return
+
+    # parse straight from the page cache rather than a copy of the whole file
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        with memoryview(m) as view:
+            yield view
+
+
+def _loads(data: Union[bytes, memoryview]) -> Any:
+    if orjson is None:
+        return json.loads(data)
+    return orjson.loads(data)
+
 
 class Tfstate:
     def __init__(self, data: Optional[Dict[str, str]] = None):
@@ -18,16 +55,67 @@ class Tfstate:
         """Read the tfstate file and load its contents.
 
         Parses then as JSON and put the result into the object.
+        With PYTHON_TERRAFORM_STATE_CACHE=1, an unchanged file which was
+        already loaded in this process is not read at all, and the same
+        Tfstate object is returned for it.
+        """
+        return Tfstate._load_file(file_path)[0]
+
+    @staticmethod
+    def _load_file(
+        file_path: str,
+        previous: Optional["Tfstate"] = None,
+        previous_digest: Optional[bytes] = None,
+    ) -> Tuple["Tfstate", Optional[bytes]]:
+        """load_file, also returning the digest of the file contents
+
+        If `previous` was loaded from the same file and its content still
+        has `previous_digest`, `previous` is returned without parsing the
+        file again. The digest is kept out of the object, whose attributes
+        are the state data itself.
         """
         logger.debug("read data from %s", file_path)
-        if os.path.exists(file_path):
-            with open(file_path) as f:
-                json_data = json.load(f)
+        try:
+            f = open(file_path, "rb")
+        except FileNotFoundError:
+            logger.debug("%s does not exist", file_path)
+            return Tfstate(), None
+
+        with f:
+            cache_key = None
+            if os.environ.get(STATE_CACHE_ENV_VAR) == "1":
+                st = os.fstat(f.fileno())
+                # the inode tells apart a file replaced by a rename, which can
+                # keep the mtime and size of the one it replaces
+                cache_key = (
+                    os.path.abspath(file_path),
+                    st.st_ino,
+                    st.st_mtime_ns,
+                    st.st_size,
+                )
+                cached = _STATE_CACHE.get(cache_key)
+                if cached is not None:
+                    logger.debug("%s is cached", file_path)
+                    return cached
+
+            with _file_contents(f) as data:
+                digest = hashlib.blake2b(data, digest_size=16).digest()
+                if (
+                    previous is not None
+                    and previous.tfstate_file == file_path
+                    and previous_digest == digest
+                ):
+                    logger.debug("%s is unchanged", file_path)
+                    return previous, digest
 
-            tf_state = Tfstate(json_data)
-            tf_state.tfstate_file = file_path
-            return tf_state
+                json_data = _loads(data)
 
-        logger.debug("%s does not exist", file_path)
+        tf_state = Tfstate(json_data)
+        tf_state.tfstate_file = file_path
 
-        return Tfstate()
+        if cache_key is not None:
+            _STATE_CACHE[cache_key] = (tf_state, digest)
+            # first in, first out
+            if len(_STATE_CACHE) > STATE_CACHE_SIZE:
+                _STATE_CACHE.popitem(last=False)
+        return tf_state, digest
@@ -32,6 +32,7 @@ setup(
     package_data={},
     platforms="any",
     install_requires=dependencies,
+    extras_require={"orjson": ["orjson"]},
     tests_require=["pytest"],
     python_requires=">=3.6",
     classifiers=[
@@ -1,134 +1,309 @@
+import asyncio
+import base64
 import fnmatch
+import functools
+import io
+import json
 import logging
 import os
 import re
 import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
 from contextlib import contextmanager
-from io import StringIO
-from typing import Callable
+from typing import Callable, List
 
 import pytest
 from _pytest.logging import LogCaptureFixture, caplog
 
-from python_terraform import IsFlagged, IsNotFlagged, Terraform, TerraformCommandError
-
-logging.basicConfig(level=logging.DEBUG)
-root_logger = logging.getLogger()
+from python_terraform import (
+    IsFlagged,
+    IsNotFlagged,
+    Terraform,
+    TerraformCommandError,
+    Tfstate,
+    VariableFiles,
+)
+from python_terraform.terraform import CommandOutput
 
 current_path = os.path.dirname(os.path.realpath(__file__))
 
 FILE_PATH_WITH_SPACE_AND_SPACIAL_CHARS = "test 'test.out!"
+
+# files and folders removed after each test, one regex for all the patterns
+PURGE_RE = re.compile(
+    "|".join(
+        fnmatch.translate(pattern)
+        for pattern in (
+            "*.tfstate",
+            "*.tfstate.backup",
+            "*.terraform",
+            FILE_PATH_WITH_SPACE_AND_SPACIAL_CHARS,
+        )
+    )
+)
+
+
+def generate_apply_no_color(tf: Terraform) -> List[str]:
+    return tf.generate_cmd_string("apply", "the_folder", no_color=IsFlagged)
+
+
+def generate_push_options(tf: Terraform) -> List[str]:
+    return tf.generate_cmd_string(
+        "push", "path", vcs=True, token="token", atlas_address="url"
+    )
+
+
+def generate_apply_scalar_vars(tf: Terraform) -> List[str]:
+    tf.inline_vars = True
+    return tf.generate_cmd_string(
+        "apply", "the_folder", var={"a": "b", "c": 1, "d": True}
+    )
+
+
 STRING_CASES = [
-    [
-        lambda x: x.generate_cmd_string("apply", "the_folder", no_color=IsFlagged),
+    pytest.param(
+        generate_apply_no_color,
         "terraform apply -no-color the_folder",
-    ],
-    [
-        lambda x: x.generate_cmd_string(
-            "push", "path", vcs=True, token="token", atlas_address="url"
-        ),
+        id="apply_no_color",
+    ),
+    pytest.param(
+        generate_push_options,
         "terraform push -vcs=true -token=token -atlas-address=url path",
-    ],
+        id="push_options",
+    ),
+    pytest.param(
+        generate_apply_scalar_vars,
+        "terraform apply -var=a=b -var=c=1 -var=d=true the_folder",
+        id="apply_scalar_vars",
+    ),
 ]
 
+
+def cmd_plan(tf: Terraform) -> CommandOutput:
+    return tf.cmd(
+        "plan",
+        "var_to_output",
+        no_color=IsFlagged,
+        var={"test_var": "test"},
+        raise_on_error=False,
+    )
+
+
+def cmd_import(tf: Terraform) -> CommandOutput:
+    # try import aws instance
+    return tf.cmd(
+        "import",
+        "aws_instance.foo",
+        "i-abcd1234",
+        no_color=IsFlagged,
+        raise_on_error=False,
+    )
+
+
+def cmd_plan_out_special_chars(tf: Terraform) -> CommandOutput:
+    # test with space and special character in file path
+    return tf.cmd(
+        "plan",
+        "var_to_output",
+        out=FILE_PATH_WITH_SPACE_AND_SPACIAL_CHARS,
+        raise_on_error=False,
+    )
+
+
+def cmd_workspace_show(tf: Terraform) -> CommandOutput:
+    # test workspace command (commands with subcommand)
+    return tf.cmd("workspace", "show", no_color=IsFlagged, raise_on_error=False)
+
+
 CMD_CASES = [
     [
         "method",
         "expected_output",
         "expected_ret_code",
-        "expected_exception",
         "expected_logs",
         "folder",
     ],
     [
-        [
-            lambda x: x.cmd(
-                "plan",
-                "var_to_output",
-                no_color=IsFlagged,
-                var={"test_var": "test"},
-                raise_on_error=False,
-            ),
+        pytest.param(
+            cmd_plan,
             # Expected output varies by terraform version
             "Plan: 0 to add, 0 to change, 0 to destroy.",
             0,
-            False,
             "",
             "var_to_output",
-        ],
-        # try import aws instance
-        [
-            lambda x: x.cmd(
-                "import",
-                "aws_instance.foo",
-                "i-abcd1234",
-                no_color=IsFlagged,
-                raise_on_error=False,
-            ),
+            id="plan",
+        ),
+        pytest.param(
+            cmd_import,
             "",
             1,
-            False,
             "Error: No Terraform configuration files",
             "",
-        ],
-        # test with space and special character in file path
-        [
-            lambda x: x.cmd(
-                "plan",
-                "var_to_output",
-                out=FILE_PATH_WITH_SPACE_AND_SPACIAL_CHARS,
-                raise_on_error=False,
-            ),
+            id="import",
+        ),
+        pytest.param(
+            cmd_plan_out_special_chars,
             "",
             0,
-            False,
             "",
             "var_to_output",
-        ],
-        # test workspace command (commands with subcommand)
-        [
-            lambda x: x.cmd(
-                "workspace", "show", no_color=IsFlagged, raise_on_error=False
-            ),
+            id="plan_out_special_chars",
+        ),
+        pytest.param(
+            cmd_workspace_show,
             "",
             0,
-            False,
             "Command: terraform workspace show -no-color",
             "",
-        ],
+            id="workspace_show",
+        ),
     ],
 ]
 
 
+# tests running terraform in the test folder itself, kept on a single
+# pytest-xdist worker as they share .terraform and state files
+shared_test_folder = pytest.mark.xdist_group("test_folder")
+
+
 @pytest.fixture(scope="function")
-def fmt_test_file(request):
-    target = os.path.join(current_path, "bad_fmt", "test.backup")
+def fmt_test_file():
     orgin = os.path.join(current_path, "bad_fmt", "test.tf")
-    shutil.copy(orgin, target)
+    with open(orgin, "rb") as f:
+        original = f.read()
+    yield
+    with open(orgin, "wb") as f:
+        f.write(original)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def tf_plugin_cache(tmp_path_factory):
+    """Providers are downloaded once per session, each init reuses them
+
+    The cache is out of the test folder, so teardown purges never reach it.
+    """
+    cache_dir = str(tmp_path_factory.mktemp("tfcache"))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("TF_PLUGIN_CACHE_DIR", cache_dir)
+        mp.setenv("TF_IN_AUTOMATION", "1")
+        mp.setenv("TF_CLI_ARGS_init", "-input=false")
+        yield cache_dir
 
-    def td():
-        shutil.move(target, orgin)
 
-    request.addfinalizer(td)
-    return
+# written by init, shared between the copies of an initialized folder
+INIT_OUTPUTS = (".terraform", ".terraform.lock.hcl")
 
 
-# @pytest.fixture()
-# def string_logger(request) -> Callable[..., str]:
-#     log_stream = StringIO()
-#     handler = logging.StreamHandler(log_stream)
-#     root_logger.addHandler(handler)
+def copy_test_folder(folder: str, working_dir: str) -> None:
+    """Copy a terraform folder of the tests, without init or apply leftovers"""
+    shutil.copytree(
+        os.path.join(current_path, folder),
+        os.path.join(working_dir, folder),
+        ignore=shutil.ignore_patterns(*INIT_OUTPUTS, "*.tfstate*"),
+    )
+
+
+def link_init_outputs(initialized_dir: str, working_dir: str, folder: str) -> None:
+    """Symlink what init wrote in initialized_dir, plan and apply only read it"""
+    for sub in ("", folder):
+        for name in INIT_OUTPUTS:
+            src = os.path.join(initialized_dir, sub, name)
+            if os.path.lexists(src):
+                os.symlink(src, os.path.join(working_dir, sub, name))
 
-#     def td():
-#         root_logger.removeHandler(handler)
-#         log_stream.close()
 
-#     request.addfinalizer(td)
-#     return lambda: str(log_stream.getvalue())
+@pytest.fixture(scope="session")
+def preinitialized_var_to_output(tmp_path_factory):
+    """var_to_output, initialized once for the whole session"""
+    working_dir = str(tmp_path_factory.mktemp("var_to_output_init"))
+    copy_test_folder("var_to_output", working_dir)
+    Terraform(working_dir=working_dir).init("var_to_output")
+    return working_dir
 
 
 @pytest.fixture()
-def workspace_setup_teardown():
+def var_to_output_workdir(preinitialized_var_to_output, tmp_path):
+    """Private working dir with var_to_output, ready without running init"""
+    copy_test_folder("var_to_output", str(tmp_path))
+    link_init_outputs(preinitialized_var_to_output, str(tmp_path), "var_to_output")
+    return str(tmp_path)
+
+
+@pytest.fixture(scope="module")
+def var_to_output_apply(preinitialized_var_to_output, tmp_path_factory):
+    """var_to_output, applied once for the tests reading it, with the result of
+    the apply"""
+    working_dir = str(tmp_path_factory.mktemp("var_to_output"))
+    copy_test_folder("var_to_output", working_dir)
+    link_init_outputs(preinitialized_var_to_output, working_dir, "var_to_output")
+    tf = Terraform(working_dir=working_dir, variables={"test_var": "test"})
+    result = tf.apply("var_to_output")
+    yield tf, result
+    tf.destroy("var_to_output")
+
+
+@pytest.fixture(scope="module")
+def applied_var_to_output(var_to_output_apply) -> Terraform:
+    return var_to_output_apply[0]
+
+
+@pytest.fixture()
+def stub_terraform(tmp_path) -> Callable[..., str]:
+    """Write bin/<name> in tmp_path as a sh script with the given body
+
+    Stands in for terraform in tests about how it is run rather than what it
+    does, which need no real binary.
+    """
+    if sys.platform == "win32":
+        pytest.skip("needs a sh stub binary")
+
+    def write(body: str, name: str = "terraform") -> str:
+        stub = tmp_path / "bin" / name
+        stub.parent.mkdir(exist_ok=True)
+        stub.write_text(f"#!/bin/sh\n{body}\n")
+        stub.chmod(0o755)
+        return str(stub)
+
+    return write
+
+
+@pytest.fixture()
+def tf() -> Terraform:
+    """Terraform on the test folder, a new one for each test
+
+    Instances are not cached across tests, they keep their state and temp
+    var files, which tests have to observe from scratch.
+    """
+    return Terraform(working_dir=current_path)
+
+
+@pytest.fixture()
+def tf_commands() -> List[str]:
+    """Command lines logged by python_terraform while the test runs
+
+    Only those records are kept, assertions do not have to scan every log
+    line of an apply.
+    """
+    commands: List[str] = []
+    handler = logging.Handler(logging.INFO)
+    handler.addFilter(lambda record: record.msg.startswith("Command:"))
+    handler.emit = lambda record: commands.append(record.getMessage())
+
+    tf_logger = logging.getLogger("python_terraform")
+    level = tf_logger.level
+    tf_logger.setLevel(logging.INFO)
+    tf_logger.addHandler(handler)
+    yield commands
+    tf_logger.removeHandler(handler)
+    tf_logger.setLevel(level)
+
+
+@pytest.fixture()
+def workspace_setup_teardown(tf):
     """Fixture used in workspace related tests.
 
     Create and tear down a workspace
@@ -137,7 +312,6 @@ def workspace_setup_teardown():
 
     @contextmanager
     def wrapper(workspace_name, create=True, delete=True, *args, **kwargs):
-        tf = Terraform(working_dir=current_path)
         tf.init()
         if create:
             tf.create_workspace(workspace_name, *args, **kwargs)
@@ -150,28 +324,61 @@ def workspace_setup_teardown():
 
 
 class TestTerraform:
-    def teardown_method(self, _) -> None:
+    @pytest.fixture(autouse=True)
+    def track_terraform_runs(self, monkeypatch) -> None:
+        """Record on the test instance whether terraform was started at all"""
+        self._ran_terraform = False
+
+        def tracked(run):
+            @functools.wraps(run)
+            def wrapper(*args, **kwargs):
+                self._ran_terraform = True
+                return run(*args, **kwargs)
+
+            return wrapper
+
+        for name in ("cmd", "cmd_async", "batch"):
+            monkeypatch.setattr(Terraform, name, tracked(getattr(Terraform, name)))
+
+    def teardown_method(self, method) -> None:
         """Teardown any state that was previously setup with a setup_method call."""
-        exclude = ["test_tfstate_file", "test_tfstate_file2", "test_tfstate_file3"]
-
-        def purge(dir: str, pattern: str) -> None:
-            for root, dirnames, filenames in os.walk(dir):
-                dirnames[:] = [d for d in dirnames if d not in exclude]
-                for filename in fnmatch.filter(filenames, pattern):
-                    f = os.path.join(root, filename)
-                    os.remove(f)
-                for dirname in fnmatch.filter(dirnames, pattern):
-                    d = os.path.join(root, dirname)
-                    shutil.rmtree(d)
-
-        purge(".", "*.tfstate")
-        purge(".", "*.tfstate.backup")
-        purge(".", "*.terraform")
-        purge(".", FILE_PATH_WITH_SPACE_AND_SPACIAL_CHARS)
+        # nothing to purge when terraform did not run, other tests work in their
+        # own temp dir, and purging from them could race with a shared test
+        # running on another worker
+        if not getattr(self, "_ran_terraform", False):
+            return
+        if shared_test_folder.mark not in getattr(method, "pytestmark", ()):
+            return
+        exclude = {"test_tfstate_file", "test_tfstate_file2", "test_tfstate_file3"}
+
+        files, dirs = [], []
+        # (folder, whether everything in it goes), a matching folder is emptied
+        # by this same walk instead of being walked again by shutil.rmtree
+        pending = [(".", False)]
+        while pending:
+            folder, purge_all = pending.pop()
+            # DirEntry.is_dir comes from readdir, no stat per entry
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        if purge_all or PURGE_RE.match(entry.name):
+                            files.append(entry.path)
+                    elif purge_all or PURGE_RE.match(entry.name):
+                        dirs.append(entry.path)
+                        pending.append((entry.path, True))
+                    elif entry.name not in exclude:
+                        pending.append((entry.path, False))
+
+        for f in files:
+            os.remove(f)
+        # a folder is always listed after its parent, so reversed is bottom-up
+        for d in reversed(dirs):
+            os.rmdir(d)
 
     @pytest.mark.parametrize(["method", "expected"], STRING_CASES)
-    def test_generate_cmd_string(self, method: Callable[..., str], expected: str):
-        tf = Terraform(working_dir=current_path)
+    def test_generate_cmd_string(
+        self, tf: Terraform, method: Callable[[Terraform], List[str]], expected: str
+    ):
         result = method(tf)
 
         strs = expected.split()
@@ -179,35 +386,35 @@ class TestTerraform:
             assert s in result
 
     @pytest.mark.parametrize(*CMD_CASES)
+    @shared_test_folder
     def test_cmd(
         self,
-        method: Callable[..., str],
+        method: Callable[[Terraform], CommandOutput],
         expected_output: str,
         expected_ret_code: int,
-        expected_exception: bool,
         expected_logs: str,
         caplog: LogCaptureFixture,
         folder: str,
+        tf: Terraform,
     ):
         with caplog.at_level(logging.INFO):
-            tf = Terraform(working_dir=current_path)
             tf.init(folder)
-            try:
-                ret, out, _ = method(tf)
-                assert not expected_exception
-            except TerraformCommandError as e:
-                assert expected_exception
-                ret = e.returncode
-                out = e.out
+            ret, out, _ = method(tf)
 
         assert expected_output in out
         assert expected_ret_code == ret
         assert expected_logs in caplog.text
 
+    @shared_test_folder
+    def test_cmd_raises(self, tf: Terraform):
+        with pytest.raises(TerraformCommandError) as e:
+            tf.cmd("import", "aws_instance.foo", "i-abcd1234", no_color=IsFlagged)
+        assert e.value.returncode == 1
+        assert "Error: No Terraform configuration files" in e.value.err
+
     @pytest.mark.parametrize(
         ("folder", "variables", "var_files", "expected_output", "options"),
         [
-            ("var_to_output", {"test_var": "test"}, None, "test_output=test", {}),
             (
                 "var_to_output",
                 {"test_list_var": ["c", "d"]},
@@ -239,29 +446,49 @@ class TestTerraform:
             ),
         ],
     )
-    def test_apply(self, folder, variables, var_files, expected_output, options):
+    def test_apply(
+        self,
+        var_to_output_workdir,
+        folder,
+        variables,
+        var_files,
+        expected_output,
+        options,
+    ):
+        # a private copy per case, so that cases can run on parallel workers
         tf = Terraform(
-            working_dir=current_path, variables=variables, var_file=var_files
+            working_dir=var_to_output_workdir, variables=variables, var_file=var_files
         )
-        tf.init(folder)
         ret, out, err = tf.apply(folder, **options)
         assert ret == 0
         assert expected_output in out.replace("\n", "").replace(" ", "")
         assert err == ""
 
-    def test_apply_with_var_file(self, caplog: LogCaptureFixture):
-        with caplog.at_level(logging.INFO):
-            tf = Terraform(working_dir=current_path)
+    def test_apply_scalar_var(self, var_to_output_apply):
+        # the {"test_var": "test"} case of test_apply, already run by the fixture
+        ret, out, err = var_to_output_apply[1]
+        assert ret == 0
+        assert "test_output=test" in out.replace("\n", "").replace(" ", "")
+        assert err == ""
 
-            folder = "var_to_output"
-            tf.init(folder)
-            tf.apply(
-                folder,
-                var_file=os.path.join(current_path, "tfvar_files", "test.tfvars"),
-            )
-        for log in caplog.messages:
-            if log.startswith("Command: terraform apply"):
-                assert log.count("-var-file=") == 1
+    def test_apply_async(self, var_to_output_workdir):
+        tf = Terraform(
+            working_dir=var_to_output_workdir, variables={"test_var": "test"}
+        )
+        ret, out, err = asyncio.run(tf.apply_async("var_to_output"))
+        assert ret == 0
+        assert "test_output=test" in out.replace("\n", "").replace(" ", "")
+        assert err == ""
+
+    def test_apply_with_var_file(self, var_to_output_workdir, tf_commands: List[str]):
+        tf = Terraform(working_dir=var_to_output_workdir)
+        folder = "var_to_output"
+        tf.apply(
+            folder, var_file=os.path.join(current_path, "tfvar_files", "test.tfvars"),
+        )
+        for command in tf_commands:
+            if command.startswith("Command: terraform apply"):
+                assert command.count("-var-file=") == 1
 
     @pytest.mark.parametrize(
         ["cmd", "args", "options"],
@@ -270,8 +497,8 @@ class TestTerraform:
             ("fmt", ["bad_fmt"], {"list": False, "diff": False})
         ],
     )
-    def test_options(self, cmd, args, options, fmt_test_file):
-        tf = Terraform(working_dir=current_path)
+    @shared_test_folder
+    def test_options(self, tf, cmd, args, options, fmt_test_file):
         ret, out, err = getattr(tf, cmd)(*args, **options)
         assert ret == 0
         assert out == ""
@@ -299,12 +526,106 @@ class TestTerraform:
         tf = Terraform(working_dir=cwd, state="tfstate.test")
         assert tf.tfstate.modules[0]["path"] == ["root"]
 
+    def test_state_data_round_trips_through_json(self):
+        cwd = os.path.join(current_path, "test_tfstate_file")
+        tf = Terraform(working_dir=cwd, state="tfstate.test")
+        data = json.loads(json.dumps(vars(tf.tfstate)))
+        assert data["modules"][0]["path"] == ["root"]
+
+    def test_state_read_after_set(self, tmp_path):
+        (tmp_path / "terraform.tfstate").write_text('{"serial": 1}')
+        tf = Terraform(working_dir=str(tmp_path))
+        assert tf.tfstate.serial == 1
+        tf.tfstate = None
+        tf.read_state_file()
+        assert tf.tfstate.serial == 1
+
+    def test_state_reused_until_file_changes(self, tmp_path, stub_terraform):
+        state_file = tmp_path / "terraform.tfstate"
+        state_file.write_text('{"serial": 1}')
+        # an apply which rewrites the state without changing it
+        tf = Terraform(
+            working_dir=str(tmp_path),
+            terraform_bin_path=stub_terraform("touch terraform.tfstate"),
+        )
+        tfstate = tf.tfstate
+        tfstate.serial = 2
+        tf.apply()
+        assert tf.tfstate is tfstate
+        state_file.write_text('{"serial": 3}')
+        tf.apply()
+        assert tf.tfstate.serial == 3
+        # an explicit read always parses the file again
+        tfstate = tf.tfstate
+        tfstate.serial = 4
+        tf.read_state_file()
+        assert tf.tfstate is not tfstate
+        assert tf.tfstate.serial == 3
+
+    def test_state_read_after_mutating_commands(
+        self, tmp_path, monkeypatch, stub_terraform
+    ):
+        (tmp_path / "terraform.tfstate").write_text('{"serial": 1}')
+        stub = stub_terraform("""echo '{"serial": 2}' > terraform.tfstate""")
+        tf = Terraform(working_dir=str(tmp_path), terraform_bin_path=stub)
+        assert tf.tfstate.serial == 1
+        tf.cmd("version")
+        tf.plan()
+        assert tf.tfstate.serial == 1
+        tf.apply()
+        assert tf.tfstate.serial == 2
+
+        # the file is not even opened when its stat did not change
+        loads = []
+        load_file = Tfstate._load_file
+        monkeypatch.setattr(
+            Tfstate,
+            "_load_file",
+            staticmethod(lambda *args: loads.append(args) or load_file(*args)),
+        )
+        tf.terraform_bin_path = stub_terraform("exit 0", "terraform-noop")
+        tf.apply()
+        assert tf.tfstate.serial == 2
+        assert loads == []
+
+    def test_variable_files(self):
+        var_files = VariableFiles()
+        variables = {"test_map_var": {"c": "c"}}
+        file_name = var_files.create(variables)
+        assert var_files.create(dict(variables)) == file_name
+        assert var_files.create({"test_map_var": {"d": "d"}}) != file_name
+        assert os.path.isfile(file_name)
+        var_files.clean_up()
+        assert not os.path.exists(file_name)
+
+    def test_state_cache(self, monkeypatch):
+        monkeypatch.setenv("PYTHON_TERRAFORM_STATE_CACHE", "1")
+        file_path = os.path.join(current_path, "test_tfstate_file", "tfstate.test")
+        tfstate = Tfstate.load_file(file_path)
+        assert Tfstate.load_file(file_path) is tfstate
+        assert tfstate.modules[0]["path"] == ["root"]
+
+    def test_state_cache_replaced_file(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("PYTHON_TERRAFORM_STATE_CACHE", "1")
+        file_path = str(tmp_path / "terraform.tfstate")
+        new_path = str(tmp_path / "terraform.tfstate.new")
+        with open(file_path, "w") as f:
+            f.write('{"serial": 1}')
+        tfstate = Tfstate.load_file(file_path)
+        # same size and mtime, written aside then renamed over the old file
+        with open(new_path, "w") as f:
+            f.write('{"serial": 2}')
+        st = os.stat(file_path)
+        os.utime(new_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(new_path, file_path)
+        assert Tfstate.load_file(file_path).serial == 2
+        assert tfstate.serial == 1
+
     @pytest.mark.parametrize(
         ("folder", "variables"), [("var_to_output", {"test_var": "test"})]
     )
-    def test_override_default(self, folder, variables):
-        tf = Terraform(working_dir=current_path, variables=variables)
-        tf.init(folder)
+    def test_override_default(self, var_to_output_workdir, folder, variables):
+        tf = Terraform(working_dir=var_to_output_workdir, variables=variables)
         ret, out, err = tf.apply(
             folder, var={"test_var": "test2"}, no_color=IsNotFlagged,
         )
@@ -314,26 +635,241 @@ class TestTerraform:
         assert "test2" in out
 
     @pytest.mark.parametrize("output_all", [True, False])
-    def test_output(self, caplog: LogCaptureFixture, output_all: bool):
+    def test_output(
+        self,
+        caplog: LogCaptureFixture,
+        output_all: bool,
+        applied_var_to_output: Terraform,
+    ):
         expected_value = "test"
         required_output = "test_output"
         with caplog.at_level(logging.INFO):
-            tf = Terraform(
-                working_dir=current_path, variables={"test_var": expected_value}
-            )
-            tf.init("var_to_output")
-            tf.apply("var_to_output")
             params = tuple() if output_all else (required_output,)
-            result = tf.output(*params)
+            result = applied_var_to_output.output(*params)
         if output_all:
             assert result[required_output]["value"] == expected_value
         else:
             assert result == expected_value
         assert expected_value in caplog.messages[-1]
 
-    def test_destroy(self):
-        tf = Terraform(working_dir=current_path, variables={"test_var": "test"})
-        tf.init("var_to_output")
+    @shared_test_folder
+    def test_evaluate(self):
+        tf = Terraform(working_dir=os.path.join(current_path, "var_to_output"))
+        tf.init()
+        result = tf.evaluate(
+            "var.test_var", "var.test_list_var", var={"test_var": "test"}
+        )
+        assert result == ["test", ["a", "b"]]
+
+    @pytest.mark.parametrize("quote", ["", '"'], ids=["unquoted", "quoted"])
+    def test_evaluate_escapes(self, tmp_path, stub_terraform, quote):
+        # template sequences, quotes and backslashes, which the quoting of
+        # strings by terraform >= 0.15 escapes
+        values = ["${a} %{b}", 'c"\\d', "\u00e9"]
+        printed = base64.b64encode(json.dumps(values).encode()).decode()
+        stub = stub_terraform(f"cat > console_in\necho '{quote}{printed}{quote}'")
+        tf = Terraform(working_dir=str(tmp_path), terraform_bin_path=stub)
+        assert tf.evaluate("var.a", "var.b", "var.c") == values
+        console_in = (tmp_path / "console_in").read_text()
+        assert console_in == "base64encode(jsonencode([var.a, var.b, var.c]))\n"
+
+    def test_submit(self, tf):
+        ret, out, err = tf.submit("version").result()
+        assert ret == 0
+        assert "Terraform v" in out
+
+    def test_cmd_timeout(self):
+        tf = Terraform(working_dir=current_path, timeout=1e-6)
+        with pytest.raises(subprocess.TimeoutExpired):
+            tf.cmd("version")
+
+    @pytest.mark.parametrize("use_async", [False, True], ids=["cmd", "cmd_async"])
+    def test_tee(self, tmp_path, capsys, stub_terraform, use_async):
+        stub = stub_terraform("echo out\necho err >&2")
+        tf = Terraform(working_dir=str(tmp_path), terraform_bin_path=stub)
+        if use_async:
+            ret, out, err = asyncio.run(tf.cmd_async("version", tee=True))
+        else:
+            ret, out, err = tf.cmd("version", tee=True)
+        assert (ret, out, err) == (0, "out\n", "err\n")
+        assert capsys.readouterr() == ("out\n", "err\n")
+
+    def test_tee_to_text_stream(self, tmp_path, monkeypatch, stub_terraform):
+        # an é split between two reads of the pipe
+        stub = stub_terraform("printf '\\303'\nsleep 0.2\nprintf '\\251\\n'")
+        tf = Terraform(working_dir=str(tmp_path), terraform_bin_path=stub)
+        stdout = io.StringIO()
+        monkeypatch.setattr(sys, "stdout", stdout)
+        ret, out, err = tf.cmd("version", tee=True)
+        assert out == "\u00e9\n"
+        assert stdout.getvalue() == "\u00e9\n"
+
+    @pytest.mark.parametrize(
+        ("is_env_vars_included", "env", "expected"),
+        [
+            pytest.param(True, {"B": "2"}, "A=1 B=2", id="merged"),
+            pytest.param(True, None, "A=1 B=", id="inherited"),
+            pytest.param(False, {"B": "2"}, "A= B=2", id="env_only"),
+            pytest.param(False, None, "A= B=", id="empty"),
+        ],
+    )
+    def test_cmd_env(
+        self, tmp_path, monkeypatch, stub_terraform, is_env_vars_included, env, expected
+    ):
+        monkeypatch.setenv("A", "1")
+        monkeypatch.delenv("B", raising=False)
+        tf = Terraform(
+            working_dir=str(tmp_path),
+            terraform_bin_path=stub_terraform('echo "A=$A B=$B"'),
+            is_env_vars_included=is_env_vars_included,
+        )
+        ret, out, err = tf.cmd("version", env=env)
+        assert out == f"{expected}\n"
+
+    def test_var_files_removed_when_terraform_missing(self, tmp_path, monkeypatch):
+        created = []
+        create = VariableFiles.create
+        monkeypatch.setattr(
+            VariableFiles,
+            "create",
+            lambda self, variables: created.append(create(self, variables))
+            or created[-1],
+        )
+        tf = Terraform(
+            working_dir=str(tmp_path), terraform_bin_path=str(tmp_path / "missing")
+        )
+        with pytest.raises(FileNotFoundError):
+            tf.apply(var={"m": {"a": "b"}})
+        assert len(created) == 1
+        assert tf.temp_var_files.dir is None
+        assert not os.path.exists(os.path.dirname(created[0]))
+
+    def test_discard_output(self, tmp_path, capfd, stub_terraform):
+        stub = stub_terraform("echo out\necho err >&2")
+        tf = Terraform(working_dir=str(tmp_path), terraform_bin_path=stub)
+        assert tf.cmd("version", capture_output="discard") == (0, None, None)
+        # capfd, terraform writes to the file descriptors it inherits
+        assert capfd.readouterr() == ("", "")
+
+    def test_cmd_timeout_with_tee_and_stdin(self, tmp_path, stub_terraform):
+        # stands in for a terraform which reads all of stdin, then hangs
+        stub = stub_terraform("cat > /dev/null\nexec sleep 30")
+        tf = Terraform(working_dir=str(tmp_path), terraform_bin_path=stub)
+        with pytest.raises(subprocess.TimeoutExpired):
+            tf.cmd("console", stdin="1 + 1\n", tee=True, timeout=0.5)
+
+    @pytest.mark.parametrize("use_async", [False, True], ids=["cmd", "cmd_async"])
+    def test_cmd_timeout_kills_wrapper_children(
+        self, tmp_path, stub_terraform, use_async
+    ):
+        # a wrapper like tfenv, whose terraform child keeps the pipes open
+        stub = stub_terraform("sleep 5")
+        tf = Terraform(working_dir=str(tmp_path), terraform_bin_path=stub)
+        start = time.monotonic()
+        with pytest.raises(subprocess.TimeoutExpired):
+            if use_async:
+                asyncio.run(tf.cmd_async("version", timeout=0.5))
+            else:
+                tf.cmd("version", timeout=0.5)
+        assert time.monotonic() - start < 3
+
+    def test_relative_bin_path(self, tmp_path, monkeypatch, stub_terraform):
+        stub_terraform("echo Terraform v1.0.0")
+        (tmp_path / "elsewhere").mkdir()
+        monkeypatch.chdir(tmp_path / "elsewhere")
+        # relative to working_dir, as Popen takes it relative to cwd
+        tf = Terraform(
+            working_dir=str(tmp_path),
+            terraform_bin_path=os.path.join("bin", "terraform"),
+        )
+        ret, out, err = tf.cmd("version")
+        assert ret == 0
+        assert "Terraform v1.0.0" in out
+
+    def test_plugin_cache_dir(self, tmp_path, monkeypatch, stub_terraform):
+        (tmp_path / "work").mkdir()
+        monkeypatch.chdir(tmp_path)
+        tf = Terraform(
+            working_dir=str(tmp_path / "work"),
+            terraform_bin_path=stub_terraform('echo "$TF_PLUGIN_CACHE_DIR"'),
+            plugin_cache_dir="cache",
+        )
+        ret, out, err = tf.cmd("init")
+        assert out == f"{tmp_path / 'cache'}\n"
+        assert (tmp_path / "cache").is_dir()
+
+    def test_reassigned_bin_path(self, tmp_path, stub_terraform):
+        tf = Terraform(
+            working_dir=str(tmp_path),
+            terraform_bin_path=stub_terraform("echo old", "terraform-old"),
+        )
+        tf.terraform_bin_path = stub_terraform("echo new")
+        assert tf.cmd("version")[1] == "new\n"
+        assert tf.batch([("version", [], {})])[1] == "new\n"
+
+    @pytest.mark.parametrize("inline_vars", [False, True])
+    # a method of its own, a generated one, and one through __getattr__
+    @pytest.mark.parametrize("method", ["plan", "apply_cmd", "metadata_cmd"])
+    def test_secrets_not_logged(
+        self, tmp_path, caplog, stub_terraform, inline_vars, method
+    ):
+        tf = Terraform(
+            working_dir=str(tmp_path),
+            terraform_bin_path=stub_terraform("exit 1"),
+            inline_vars=inline_vars,
+        )
+        with caplog.at_level(logging.DEBUG):
+            with pytest.raises(TerraformCommandError) as e:
+                getattr(tf, method)(
+                    var={"password": "s3cr3t"},
+                    backend_config={"secret_key": "s3cr3t"},
+                    raise_on_error=True,
+                )
+        assert "s3cr3t" not in caplog.text
+        assert "s3cr3t" not in e.value.cmd
+        assert "password" in caplog.text
+
+    def test_batch(self, tf):
+        ret, out, err = tf.batch([("version", [], {}), ("version", [], {})])
+        assert ret == 0
+        assert out.count("Terraform v") == 2
+
+    def test_batch_reads_state_after_failed_step(self, tmp_path, stub_terraform):
+        stub = stub_terraform(
+            """case "$1" in
+  apply) echo '{"serial": 2}' > terraform.tfstate;;
+  *) exit 1;;
+esac"""
+        )
+        (tmp_path / "terraform.tfstate").write_text('{"serial": 1}')
+        tf = Terraform(working_dir=str(tmp_path), terraform_bin_path=stub)
+        assert tf.tfstate.serial == 1
+        ret, out, err = tf.batch(
+            [("apply", [], {}), ("plan", [], {})], raise_on_error=False
+        )
+        assert ret == 1
+        assert tf.tfstate.serial == 2
+
+    def test_batch_interrupt_stops_terraform(self, tmp_path, stub_terraform):
+        stub = stub_terraform("sleep 1\ntouch still-running")
+        tf = Terraform(working_dir=str(tmp_path), terraform_bin_path=stub)
+        # Ctrl-C reaches us only, the batch runs in its own session
+        timer = threading.Timer(0.3, os.kill, (os.getpid(), signal.SIGINT))
+        timer.start()
+        with pytest.raises(KeyboardInterrupt):
+            tf.batch([("apply", [], {})], timeout=30)
+        time.sleep(1.5)
+        assert not (tmp_path / "still-running").exists()
+
+    def test_parallel_cmd_rejects_shared_working_dir(self):
+        instances = [Terraform(working_dir=current_path) for _ in range(2)]
+        with pytest.raises(ValueError):
+            Terraform.parallel_cmd(instances, "plan")
+
+    def test_destroy(self, var_to_output_workdir):
+        tf = Terraform(
+            working_dir=var_to_output_workdir, variables={"test_var": "test"}
+        )
         ret, out, err = tf.destroy("var_to_output")
         assert ret == 0
         assert "Destroy complete! Resources: 0 destroyed." in out
@@ -341,6 +877,7 @@ class TestTerraform:
     @pytest.mark.parametrize(
         ("plan", "variables", "expected_ret"), [("vars_require_input", {}, 1)]
     )
+    @shared_test_folder
     def test_plan(self, plan, variables, expected_ret):
         tf = Terraform(working_dir=current_path, variables=variables)
         tf.init(plan)
@@ -351,11 +888,13 @@ class TestTerraform:
             == """\nError: Missing required argument\n\nThe argument "region" is required, but was not set.\n\n"""
         )
 
+    @shared_test_folder
     def test_fmt(self, fmt_test_file):
         tf = Terraform(working_dir=current_path, variables={"test_var": "test"})
         ret, out, err = tf.fmt(diff=True)
         assert ret == 0
 
+    @shared_test_folder
     def test_create_workspace(self, workspace_setup_teardown):
         workspace_name = "test"
         with workspace_setup_teardown(workspace_name, create=False) as tf:
@@ -363,14 +902,13 @@ class TestTerraform:
         assert ret == 0
         assert err == ""
 
-    def test_create_workspace_with_args(self, workspace_setup_teardown, caplog):
+    @shared_test_folder
+    def test_create_workspace_with_args(self, workspace_setup_teardown, tf_commands):
         workspace_name = "test"
         state_file_path = os.path.join(
             current_path, "test_tfstate_file2", "terraform.tfstate"
         )
-        with workspace_setup_teardown(
-            workspace_name, create=False
-        ) as tf, caplog.at_level(logging.INFO):
+        with workspace_setup_teardown(workspace_name, create=False) as tf:
             ret, out, err = tf.create_workspace(
                 "test", current_path, no_color=IsFlagged
             )
@@ -379,9 +917,10 @@ class TestTerraform:
         assert err == ""
         assert (
             f"Command: terraform workspace new -no-color test {current_path}"
-            in caplog.messages
+            in tf_commands
         )
 
+    @shared_test_folder
     def test_set_workspace(self, workspace_setup_teardown):
         workspace_name = "test"
         with workspace_setup_teardown(workspace_name) as tf:
@@ -389,11 +928,10 @@ class TestTerraform:
         assert ret == 0
         assert err == ""
 
-    def test_set_workspace_with_args(self, workspace_setup_teardown, caplog):
+    @shared_test_folder
+    def test_set_workspace_with_args(self, workspace_setup_teardown, tf_commands):
         workspace_name = "test"
-        with workspace_setup_teardown(workspace_name) as tf, caplog.at_level(
-            logging.INFO
-        ):
+        with workspace_setup_teardown(workspace_name) as tf:
             ret, out, err = tf.set_workspace(
                 workspace_name, current_path, no_color=IsFlagged
             )
@@ -402,9 +940,10 @@ class TestTerraform:
         assert err == ""
         assert (
             f"Command: terraform workspace select -no-color test {current_path}"
-            in caplog.messages
+            in tf_commands
         )
 
+    @shared_test_folder
     def test_show_workspace(self, workspace_setup_teardown):
         workspace_name = "test"
         with workspace_setup_teardown(workspace_name) as tf:
@@ -412,17 +951,17 @@ class TestTerraform:
         assert ret == 0
         assert err == ""
 
-    def test_show_workspace_with_no_color(self, workspace_setup_teardown, caplog):
+    @shared_test_folder
+    def test_show_workspace_with_no_color(self, workspace_setup_teardown, tf_commands):
         workspace_name = "test"
-        with workspace_setup_teardown(workspace_name) as tf, caplog.at_level(
-            logging.INFO
-        ):
+        with workspace_setup_teardown(workspace_name) as tf:
             ret, out, err = tf.show_workspace(no_color=IsFlagged)
 
         assert ret == 0
         assert err == ""
-        assert "Command: terraform workspace show -no-color" in caplog.messages
+        assert "Command: terraform workspace show -no-color" in tf_commands
 
+    @shared_test_folder
     def test_delete_workspace(self, workspace_setup_teardown):
         workspace_name = "test"
         with workspace_setup_teardown(workspace_name, delete=False) as tf:
@@ -431,11 +970,10 @@ class TestTerraform:
         assert ret == 0
         assert err == ""
 
-    def test_delete_workspace_with_args(self, workspace_setup_teardown, caplog):
+    @shared_test_folder
+    def test_delete_workspace_with_args(self, workspace_setup_teardown, tf_commands):
         workspace_name = "test"
-        with workspace_setup_teardown(
-            workspace_name, delete=False
-        ) as tf, caplog.at_level(logging.INFO):
+        with workspace_setup_teardown(workspace_name, delete=False) as tf:
             tf.set_workspace("default")
             ret, out, err = tf.delete_workspace(
                 workspace_name, current_path, force=IsFlagged,
@@ -445,11 +983,11 @@ class TestTerraform:
         assert err == ""
         assert (
             f"Command: terraform workspace delete -force test {current_path}"
-            in caplog.messages
+            in tf_commands
         )
 
-    def test_list_workspace(self):
-        tf = Terraform(working_dir=current_path)
+    @shared_test_folder
+    def test_list_workspace(self, tf):
         workspaces = tf.list_workspace()
         assert len(workspaces) > 0
         assert 'default' in workspaces